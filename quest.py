@@ -10,14 +10,17 @@ pip install pytmx
 """
 from __future__ import annotations
 
+from itertools import product
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Set, Tuple
+from xml.etree import ElementTree
 
 import pygame
 from pygame import sprite
 from pygame.locals import K_UP, K_DOWN, K_LEFT, K_RIGHT, K_MINUS, K_EQUALS, K_ESCAPE, K_SPACE
 from pygame.locals import KEYDOWN, VIDEORESIZE, QUIT
-from pytmx.util_pygame import load_pygame
+import pytmx
+from pytmx.util_pygame import load_pygame, pygame_image_loader
 
 import pyscroll
 import pyscroll.data
@@ -25,12 +28,20 @@ from pyscroll.group import PyscrollGroup
 
 import random
 import glob
+import json
 import os
+import sys
+import time
 
 # define configuration variables here
 CURRENT_DIR = Path(__file__).parent
 RESOURCES_DIR = CURRENT_DIR / "graphics"
+DATA_DIR = CURRENT_DIR / "data"
 HERO_MOVE_SPEED = 200  # pixels per second
+HOT_RELOAD = True  # rebuild maps and data tables when their files change
+HOT_RELOAD_INTERVAL = 0.5  # seconds between file watcher polls
+FLATTEN_TILE_LAYERS = True  # pre-composite static tile layers, see FlattenedMapData
+FLATTEN_CHUNK_TILES = 4  # max tiles per side of a pre-composited chunk
 
 
 # simple wrapper to keep the screen resizeable
@@ -48,6 +59,92 @@ def load_image(filename: str) -> pygame.Surface:
     print(str(RESOURCES_DIR / filename))
     return pygame.image.load(str(RESOURCES_DIR / filename))
 
+
+# character, dialog and quest definitions live in json files under data/
+def load_data(filename: str):
+    with open(DATA_DIR / filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class FileWatcher:
+    """Polls a set of files and reports the ones whose mtime changed.
+
+    Polling keeps this dependency free; the game only checks every
+    HOT_RELOAD_INTERVAL seconds so the cost is a handful of stat calls.
+    """
+
+    def __init__(self) -> None:
+        self._mtimes = {}
+
+    @staticmethod
+    def _mtime(path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, paths) -> None:
+        for path in paths:
+            path = os.path.abspath(path)
+            if path not in self._mtimes:
+                self._mtimes[path] = self._mtime(path)
+
+    def poll(self) -> Set[str]:
+        changed = set()
+        for path, old_mtime in self._mtimes.items():
+            mtime = self._mtime(path)
+            if mtime != old_mtime:
+                self._mtimes[path] = mtime
+                changed.add(path)
+
+        return changed
+
+
+class TilesetCache:
+    """pytmx image loader that keeps tileset surfaces between map loads.
+
+    Tiles are keyed by image path and mtime, so reloading a map after a TMX
+    edit reuses the already converted surfaces and only images that changed
+    on disk are read again.
+    """
+
+    def __init__(self) -> None:
+        self._images = {}
+        self._requested = set()
+
+    def image_loader(self, filename: str, colorkey, **kwargs):
+        path = os.path.abspath(filename)
+        mtime = os.stat(path).st_mtime_ns
+        self._requested.add(path)
+
+        key = (path, colorkey)
+        cached = self._images.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, pygame_image_loader(filename, colorkey, **kwargs), {})
+            self._images[key] = cached
+        _, load_image, tiles = cached
+
+        def load_tile(rect=None, flags=None):
+            tile_key = (tuple(rect) if rect else None, flags)
+            if tile_key not in tiles:
+                tiles[tile_key] = load_image(rect, flags)
+            return tiles[tile_key]
+
+        return load_tile
+
+    def load_map(self, filename) -> Tuple[pytmx.TiledMap, Set[str]]:
+        """Load a TMX file, returning the map and every file it was built from"""
+        filename = os.path.abspath(filename)
+        self._requested = set()
+        tmx_data = pytmx.TiledMap(filename, image_loader=self.image_loader)
+
+        sources = {filename} | self._requested
+        for node in ElementTree.parse(filename).getroot().iter('tileset'):
+            if node.get('source'):
+                sources.add(os.path.abspath(os.path.join(os.path.dirname(filename), node.get('source'))))
+
+        return tmx_data, sources
+
 class Item (pygame.sprite.Sprite):
 
     def __init__(self, name, graphic_file, x, y):
@@ -219,10 +316,84 @@ class Character(pygame.sprite.Sprite):
         self.rect.topleft = self._position
         self.feet.midbottom = self.rect.midbottom
 
+class FlattenedMapData(pyscroll.data.PyscrollDataAdapter):
+    """pyscroll data source with the static tile layers pre-composited.
+
+    Tile layers up to the sprite layer are flattened into a background and
+    the layers above it into a foreground, both cut into chunks of a few
+    tiles.  Each chunk is handed to pyscroll as one big tile, so a buffer
+    refill is a few large blits instead of one blit per tile per layer.
+
+    The chunk size always divides the map size, so map_rect is unchanged.
+    Tile animations are not supported; tiles are baked as they are loaded.
+    """
+
+    def __init__(self, tmx, sprite_layer: int, chunk_tiles: int = FLATTEN_CHUNK_TILES) -> None:
+        super().__init__()
+        self.tmx = tmx
+        self.sprite_layer = sprite_layer
+        self.chunk_tiles = chunk_tiles
+        self.reload_data()
+
+    def reload_data(self) -> None:
+        tw, th = self.tmx.tilewidth, self.tmx.tileheight
+        mw, mh = self.tmx.width, self.tmx.height
+        cw = max(i for i in range(1, min(self.chunk_tiles, mw) + 1) if mw % i == 0)
+        ch = max(i for i in range(1, min(self.chunk_tiles, mh) + 1) if mh % i == 0)
+        self._chunk_tiles = cw, ch
+
+        # background sits just below the sprites, foreground just above them
+        background = self.sprite_layer - 1, [l for l in self.tmx.visible_tile_layers if l <= self.sprite_layer]
+        foreground = self.sprite_layer + 1, [l for l in self.tmx.visible_tile_layers if l > self.sprite_layer]
+
+        self._chunks = {}
+        for cx, cy in product(range(mw // cw), range(mh // ch)):
+            for layer, tile_layers in (background, foreground):
+                blits = []
+                for l, y, x in product(tile_layers, range(cy * ch, (cy + 1) * ch), range(cx * cw, (cx + 1) * cw)):
+                    image = self.tmx.get_tile_image(x, y, l)
+                    if image:
+                        blits.append((image, ((x - cx * cw) * tw, (y - cy * ch) * th)))
+
+                if blits:
+                    if layer < self.sprite_layer:
+                        chunk = pygame.Surface((cw * tw, ch * th)).convert()
+                    else:
+                        chunk = pygame.Surface((cw * tw, ch * th), pygame.SRCALPHA).convert_alpha()
+                    chunk.blits(blits, doreturn=False)
+                    self._chunks[(cx, cy, layer)] = chunk
+
+        self._visible_tile_layers = sorted({layer for _, _, layer in self._chunks})
+        self.reload_animations()
+
+    def get_animations(self):
+        return iter(())
+
+    @property
+    def tile_size(self):
+        return self.tmx.tilewidth * self._chunk_tiles[0], self.tmx.tileheight * self._chunk_tiles[1]
+
+    @property
+    def map_size(self):
+        return self.tmx.width // self._chunk_tiles[0], self.tmx.height // self._chunk_tiles[1]
+
+    @property
+    def visible_tile_layers(self):
+        return self._visible_tile_layers
+
+    def _get_tile_image(self, x: int, y: int, l: int):
+        return self._chunks.get((x, y, l))
+
+
 class GameMap:
     map_path = RESOURCES_DIR.joinpath('map') 
-    def __init__(self, map, screen, zoom=2, clamp_camera=False, characters=None, hero=None, hero_x=None, hero_y=None):
-        tmx_data = load_pygame(self.map_path.joinpath(map))
+    def __init__(self, map, screen, zoom=2, clamp_camera=False, characters=None, hero=None, hero_x=None, hero_y=None, tileset_cache=None, flatten=FLATTEN_TILE_LAYERS):
+        # sources = every file this map was built from, used for hot reload
+        if tileset_cache:
+            tmx_data, self.sources = tileset_cache.load_map(self.map_path.joinpath(map))
+        else:
+            tmx_data = load_pygame(self.map_path.joinpath(map))
+            self.sources = {os.path.abspath(self.map_path.joinpath(map))}
 
         self.screen = screen
         """zones = where other island residents are.
@@ -267,8 +438,17 @@ class GameMap:
 
 
 
+        # pyscroll supports layered rendering.  our map has 3 'under' layers
+        # layers begin with 0, so the layers are 0, 1, and 2.
+        # since we want the sprite to be on top of layer 1, we set the default
+        # layer for sprites as 2
+        sprite_layer = 2
+
         # create new data source for pyscroll
-        map_data = pyscroll.data.TiledMapData(tmx_data)
+        if flatten:
+            map_data = FlattenedMapData(tmx_data, sprite_layer)
+        else:
+            map_data = pyscroll.data.TiledMapData(tmx_data)
 
         # create new renderer (camera)
         self.map_layer = pyscroll.BufferedRenderer(
@@ -276,11 +456,7 @@ class GameMap:
         )
         self.map_layer.zoom = zoom
 
-        # pyscroll supports layered rendering.  our map has 3 'under' layers
-        # layers begin with 0, so the layers are 0, 1, and 2.
-        # since we want the sprite to be on top of layer 1, we set the default
-        # layer for sprites as 2
-        self.group = PyscrollGroup(map_layer=self.map_layer, default_layer=2)
+        self.group = PyscrollGroup(map_layer=self.map_layer, default_layer=sprite_layer)
 
         
         self.hero = hero if hero else Character()
@@ -332,6 +508,11 @@ class GameMap:
     
             self.group.add(self.characters[-1])
 
+    def remove_characters(self) -> None:
+        for character in self.characters:
+            character.kill()
+        self.characters = []
+
     def draw(self) -> None:
 
         # center the map/screen on our Hero
@@ -485,84 +666,110 @@ class QuestGame:
         # true while running
         self.running = False
 
-        # Characters
-        characters = [
-            {
-                "name": "ariel_00", 
-                "x": 1315, 
-                "y": 600,
-                "dialogs": {
-                    "1": "Hello, I have lost my fork. \n Can you find it for me?",
-                    "2": "Oh, you haven’t found my fork yet…",
-                    "3": "Thank you so much for finding my fork!",
-                    "4": "Oh, you look busy with other \n quests right now. Find me later... \n I might have a new quest for you.",
-                    "5": "Oh, you have already finished my \n quest. Maybe try finding a different \n character."
-                }
-                },
-            
-            {
-                "name": "aladdin_00", 
-                "x": 295, 
-                "y": 450,
-                "dialogs": {
-                    "1": "Hello, I have lost my magic lamp. \n Can you find it for me?",
-                    "2": "Oh, you haven’t found my magic lamp yet…",
-                    "3": "Thank you so much for finding my magic lamp!",
-                    "4": "Oh, you look busy with other \n quests right now. Find me later... \n I might have a new quest for you.",
-                    "5": "Oh, you have already finished my \n quest. Maybe try finding a different \n character."
-                }
-                },
-            
-            {
-                "name": "tiana_00", 
-                "x": 1304, 
-                "y": 298,
-                "dialogs": {
-                    "1": "Hello, I have lost my bread. \n Can you find it for me?",
-                    "2": "Oh, you haven’t found my bread yet…",
-                    "3": "Thank you so much for finding my bread!",
-                    "4": "Oh, you look busy with other \n quests right now. Find me later... \n I might have a new quest for you.",
-                    "5": "Oh, you have already finished my \n quest. Maybe try finding a different \n character."
-                }
-            },
-            
-            {
-                "name": "pirategirl_00", 
-                "x": 141, 
-                "y": 70,
-                "dialogs": {
-                    "1": "Hello, I have lost my compass. \n Can you find it for me?",
-                    "2": "Oh, you haven’t found my compass yet…",
-                    "3": "Thank you so much for finding my compass!",
-                    "4": "Oh, you look busy with other \n quests right now. Find me later... \n I might have a new quest for you.",
-                    "5": "Oh, you have already finished my \n quest. Maybe try finding a different \n character."
-                }
-            }
-        ]
-
-        QuestGame.quests['ariel_00_quest'] =  Quest('ariel_00_quest', 'restaurant.tmx', Item('fork', 'ariel_00.png', 550, 421))
-        QuestGame.quests['aladdin_00_quest'] = Quest('aladdin_00_quest', 'aladdin_house.tmx', Item('magiclamp', 'aladdin_00.png', 564, 223))
-        QuestGame.quests['tiana_00_quest'] = Quest('tiana_00_quest', 'tiana_house.tmx', Item('bread', 'tiana_00.png', 371, 355))
-        QuestGame.quests['pirategirl_00_quest'] = Quest('pirategirl_00_quest', 'pirate_ship_inside.tmx', Item('compass', 'pirategirl_00.png', 180, 280))
-        
+        self.tileset_cache = TilesetCache()
+        self.watcher = FileWatcher()
+        self.watch_elapsed = 0.0
+
+        # Characters, dialogs and quests
+        self.characters = self.load_characters()
+        self.load_quests()
+        self.watcher.watch(DATA_DIR.joinpath(name) for name in ('characters.json', 'dialogs.json', 'quests.json'))
+
         #maps
         maps = glob.glob('**/*.tmx', recursive=True)
         self.maps = {}
         for map in maps:
             map_name = Path(map).name
-            self.maps[map_name] = GameMap(map_name, screen, hero=Character())
+            self.maps[map_name] = self.load_map(map_name)
 
-            if map_name == 'island_map.tmx':
-                self.maps[map_name].add_characters(characters)
-            else:
-                self.maps[map_name].hero._position[0] = self.maps[map_name].hero_start_position[0]
-                self.maps[map_name].hero._position[1] = self.maps[map_name].hero_start_position[1]
-                self.maps[map_name].zoom = 1
-                self.maps[map_name].clamp_camera = True
+        self.current_map = 'island_map.tmx'
 
-            self.current_map = 'island_map.tmx'
+    def load_characters(self) -> List[dict]:
+        """Merge character positions with their dialogs"""
+        dialogs = load_data('dialogs.json')
+        characters = load_data('characters.json')
+        for character in characters:
+            character['dialogs'] = dialogs[character['name']]
+
+        return characters
+
+    def load_quests(self) -> None:
+        """(Re)build the quest table, keeping the progress of known quests"""
+        for data in load_data('quests.json'):
+            item = data['item']
+            quest = Quest(data['name'], data['location'], Item(item['name'], item['graphic_file'], item['x'], item['y']))
+
+            old_quest = QuestGame.quests.get(quest.name)
+            if old_quest:
+                quest.status = old_quest.status
+                quest.future_status = old_quest.future_status
+                old_quest.item.kill()
+
+            QuestGame.quests[quest.name] = quest
+
+    def load_map(self, map_name: str, previous: GameMap = None) -> GameMap:
+        """Build a GameMap; when replacing a map, carry its state across"""
+        hero_position = previous.hero.position if previous else None
+        game_map = GameMap(map_name, self.screen, hero=previous.hero if previous else Character(), tileset_cache=self.tileset_cache)
+
+        if previous:
+            # quest items are put back by the game loop once they are missing
+            previous.group.empty()
+            game_map.hero.position = hero_position
+            game_map.zoom = previous.zoom
+            game_map.clamp_camera = previous.map_layer.clamp_camera
+            game_map._dialog = previous._dialog
+            game_map.characters = previous.characters
+            game_map.group.add(game_map.characters)
+        elif map_name == 'island_map.tmx':
+            game_map.add_characters(self.characters)
+        else:
+            game_map.hero._position[0] = game_map.hero_start_position[0]
+            game_map.hero._position[1] = game_map.hero_start_position[1]
+            game_map.zoom = 1
+            game_map.clamp_camera = True
+
+        self.watcher.watch(game_map.sources)
+        return game_map
+
+    def hot_reload(self) -> None:
+        """Rebuild only the maps and data tables whose files changed"""
+        changed = self.watcher.poll()
+        if not changed:
+            return
+
+        start = time.perf_counter()
+        reloaded = []
+        try:
+            if str(DATA_DIR.joinpath('quests.json')) in changed:
+                self.load_quests()
+                reloaded.append('quests.json')
+
+            if changed & {str(DATA_DIR.joinpath(name)) for name in ('characters.json', 'dialogs.json')}:
+                characters = self.load_characters()
+                if str(DATA_DIR.joinpath('characters.json')) in changed:
+                    self.maps['island_map.tmx'].remove_characters()
+                    self.maps['island_map.tmx'].add_characters(characters)
+                else:
+                    # dialog edits only, the characters can keep walking
+                    dialogs = {character['name']: character['dialogs'] for character in characters}
+                    for character in self.maps['island_map.tmx'].characters:
+                        character.dialogs = dialogs[character.name]
+                self.characters = characters
+                reloaded.append('characters')
+
+            for map_name, game_map in self.maps.items():
+                if game_map.sources & changed:
+                    self.maps[map_name] = self.load_map(map_name, previous=game_map)
+                    reloaded.append(map_name)
+
+        except Exception as e:
+            # most likely a half saved file, keep playing with the old data
+            print('hot reload failed:', e)
+            return
+
+        print('reloaded {} in {:.1f} ms'.format(', '.join(reloaded), (time.perf_counter() - start) * 1000))
 
-        
     def handle_input(self) -> None:
         """Handle pygame input events"""
         poll = pygame.event.poll
@@ -634,6 +841,12 @@ class QuestGame:
                 dt = clock.tick() / 1000.0
                 times.append(clock.get_fps())
 
+                if HOT_RELOAD:
+                    self.watch_elapsed += dt
+                    if self.watch_elapsed >= HOT_RELOAD_INTERVAL:
+                        self.watch_elapsed = 0.0
+                        self.hot_reload()
+
                 self.handle_input()
                 self.maps[self.current_map].move_characters()
                 
@@ -683,5 +896,41 @@ def main() -> None:
         pygame.quit()
 
 
+def benchmark_refill(rounds: int = 50) -> None:
+    """Time pyscroll buffer refills for every map, layered vs flattened"""
+    pygame.init()
+    screen = init_screen(800, 600)
+
+    for map in sorted(glob.glob('**/*.tmx', recursive=True)):
+        map_name = Path(map).name
+        results = []
+        for flatten in (False, True):
+            game_map = GameMap(map_name, screen, flatten=flatten)
+            map_layer = game_map.map_layer
+
+            # full redraws, as done after a zoom, resize or map switch
+            start = time.perf_counter()
+            for _ in range(rounds):
+                map_layer.redraw_tiles(map_layer._buffer)
+            redraw = (time.perf_counter() - start) / rounds
+
+            # edge refills while the camera sweeps over the map
+            start = time.perf_counter()
+            for x in range(0, map_layer.map_rect.width, 4):
+                map_layer.center((x, map_layer.map_rect.centery))
+            scroll = time.perf_counter() - start
+
+            results.append((redraw, scroll))
+
+        (layered_redraw, layered_scroll), (flat_redraw, flat_scroll) = results
+        print('{:24} redraw {:7.3f} ms -> {:7.3f} ms   sweep {:7.2f} ms -> {:7.2f} ms'.format(
+            map_name, layered_redraw * 1000, flat_redraw * 1000, layered_scroll * 1000, flat_scroll * 1000))
+
+    pygame.quit()
+
+
 if __name__ == "__main__":
-    main()
+    if '--benchmark-refill' in sys.argv:
+        benchmark_refill()
+    else:
+        main()